@@ -2,14 +2,13 @@ import argparse
 import asyncio
 
 from bleak import BleakScanner
-from bleak import BleakClient
 
-import pandas as pd
 from datetime import datetime
-import keyboard
+
+from ahm_core import advertisement_row, save_advertisements, startup_mark
 
 search_string = 'AHM_PANDEY_LAB'
-df = pd.DataFrame(columns=['Date', 'Time', 'Address', 'Local_Name', 'RSS_in_dBm', 'tx_power', 'service_data', 'service_uuids', 'manufacturer_data', 'platform_data'])
+scans = []  # Scanned advertisement rows, saved to Excel when scanning stops
 
 async def scan(args: argparse.Namespace):
     print("scanning for 1 second. if you want to stop scanning, press 's'")
@@ -20,14 +19,13 @@ async def scan(args: argparse.Namespace):
 
     for d, a in devices.values():
         if a.local_name == search_string:
-            now = datetime.now()
-            date = now.strftime('%Y/%m/%d')
-            time = now.strftime('%H:%M:%S.%f')
-            scan = [date, time, d.address, a.local_name, a.rssi, a.tx_power, a.service_data, a.service_uuids, a.manufacturer_data, a.platform_data]
-            df.loc[len(df)] = scan
-    print(df)
+            startup_mark("first_advertisement")
+            scan = advertisement_row(datetime.now(), d, a)
+            scans.append(scan)
+            print(len(scans) - 1, *scan[:5])
 
 if __name__ == "__main__":
+    startup_mark("imported")
     parser = argparse.ArgumentParser()
 
     parser.add_argument(
@@ -43,11 +41,14 @@ if __name__ == "__main__":
     while running:
         asyncio.run(scan(args))
 
+        # Imported after the first scan so that it does not delay the first capture
+        import keyboard
+
         if keyboard.is_pressed('s'):
-            print("Stopping scanning and saving DataFrame to Excel...")
+            print("Stopping scanning and saving scans to Excel...")
             now = datetime.now()
             date = now.strftime('%Y-%m-%d')
             time = now.strftime('%H%M')
             filename = "BLE_Scanned_"+date+"_"+time+".xlsx"
-            df.to_excel(filename)
+            save_advertisements(scans, filename)
             running = False
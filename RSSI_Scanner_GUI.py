@@ -1,11 +1,11 @@
 import asyncio
 import tkinter as tk
 from tkinter import scrolledtext
-import pandas as pd
 from datetime import datetime
 import argparse
 from bleak import BleakScanner
-from bleak import BleakClient
+
+from ahm_core import advertisement_row, save_advertisements, startup_mark
 
 Device_list = []
 
@@ -31,7 +31,7 @@ class MyWindow(tk.Tk):
         self.text_output = scrolledtext.ScrolledText(self, width=60, height=20)
         self.text_output.grid(row=1, column=0, padx=5, pady=5, sticky="nsew")
 
-        self.df = pd.DataFrame(columns=['Date', 'Time', 'Address', 'Local_Name', 'RSS_in_dBm', 'tx_power', 'service_data', 'service_uuids', 'manufacturer_data', 'platform_data'])
+        self.scans = []  # Scanned advertisement rows, saved to CSV when scanning stops
 
         self.grid_columnconfigure(0, weight=1)
         self.grid_rowconfigure(1, weight=1)
@@ -50,11 +50,10 @@ class MyWindow(tk.Tk):
             
             for d, a in devices.values():
                 if a.local_name == search_string:
-                    now = datetime.now()
-                    date = now.strftime('%Y/%m/%d')
-                    time = now.strftime('%H:%M:%S.%f')
-                    scan = [date, time, d.address, a.local_name, a.rssi, a.tx_power, a.service_data, a.service_uuids, a.manufacturer_data, a.platform_data]
-                    self.df.loc[len(self.df)] = scan
+                    startup_mark("first_advertisement")
+                    scan = advertisement_row(datetime.now(), d, a)
+                    date, time = scan[:2]
+                    self.scans.append(scan)
                     Device_list.append(d.address)
 
                     self.text_output.insert(tk.END, f"{date} {time} - {a.local_name} ({d.address}) RSSI: {a.rssi}\n")
@@ -73,14 +72,14 @@ class MyWindow(tk.Tk):
             asyncio.create_task(self.save_to_csv())
 
     async def save_to_csv(self):
-        self.text_output.insert(tk.END, "Stopping scanning and saving DataFrame to CSV...")
+        self.text_output.insert(tk.END, "Stopping scanning and saving scans to CSV...")
         self.text_output.see(tk.END)
         now = datetime.now()
         date = now.strftime('%Y-%m-%d')
         time = now.strftime('%H%M')
         filename = "BLE_Scanned_"+date+"_"+time+".csv"
-        self.df.to_csv(filename)
-        self.text_output.insert(tk.END, f"DataFrame saved to {filename}\n")
+        save_advertisements(self.scans, filename)
+        self.text_output.insert(tk.END, f"Scans saved to {filename}\n")
         self.text_output.see(tk.END)
 
     def on_close(self):
@@ -94,6 +93,7 @@ class MyWindow(tk.Tk):
 
 
 async def main():
+    startup_mark("imported")
     await start_window()
 
 if __name__ == "__main__":
@@ -0,0 +1,108 @@
+"""
+Small core shared by the receivers and the RSSI scanners. It only imports the
+standard library, heavy dependencies are imported by the features using them.
+"""
+import csv
+import os
+
+# Nordic UART Service (NUS) UUIDs
+NUS_SERVICE_UUID = "6e400001-b5a3-f393-e0a9-e50e24dcca9e"
+NUS_RX_UUID = "6e400002-b5a3-f393-e0a9-e50e24dcca9e"
+NUS_TX_UUID = "6e400003-b5a3-f393-e0a9-e50e24dcca9e"
+DEVICE_NAME_SUBSTRING = "AHM_PANDEY_LAB"
+
+SUMMARY_PREFIX = "S:"
+SUMMARY_FIELDS = ["window.s", "samples", "accel.mag.mean", "accel.mag.var", "gyro.mag.mean", "gyro.mag.var"]
+CSV_HEADER = ["Date", "Time", "Device Name", "accel.X", "accel.Y", "accel.Z", "gyro.X", "gyro.Y", "gyro.Z", "temp.O", "temp.A", "battery.V"]
+ADVERTISEMENT_COLUMNS = ['Date', 'Time', 'Address', 'Local_Name', 'RSS_in_dBm', 'tx_power', 'service_data', 'service_uuids', 'manufacturer_data', 'platform_data']
+
+# Set by startup_benchmark.py, makes startup_mark print the startup milestones
+STARTUP_BENCHMARK = os.environ.get("AHM_STARTUP_BENCHMARK") == "1"
+STARTUP_MARK_PREFIX = "AHM_STARTUP"
+_startup_marks = set()
+
+
+def startup_mark(event):
+    if STARTUP_BENCHMARK and event not in _startup_marks:
+        _startup_marks.add(event)
+        print(f"{STARTUP_MARK_PREFIX} {event}", flush=True)
+
+
+def parse_complete_message(complete_message):
+    """
+    Parses the complete message and returns a dictionary with the parsed values.
+    """
+    parsed_data = {
+        "accel.X": "",
+        "accel.Y": "",
+        "accel.Z": "",
+        "gyro.X": "",
+        "gyro.Y": "",
+        "gyro.Z": "",
+        "temp.O": "",
+        "temp.A": "",
+        "battery.V": ""
+    }
+
+    try:
+        if "A:" in complete_message and ";G:" in complete_message:
+            # Parse accelerometer and gyroscope data
+            accel_part, gyro_part = complete_message.split(";G:")
+            _, accel_values = accel_part.split("A:")
+            parsed_data["accel.X"], parsed_data["accel.Y"], parsed_data["accel.Z"] = map(float, accel_values.split(","))
+            parsed_data["gyro.X"], parsed_data["gyro.Y"], parsed_data["gyro.Z"] = map(float, gyro_part.split(","))
+
+        if "V:" in complete_message and ";T:" in complete_message:
+            # Parse voltage and temperature data
+            voltage_part, temp_part = complete_message.split(";T:")
+            _, voltage_value = voltage_part.split("V:")
+            temp_values = temp_part.split(",")
+            parsed_data["battery.V"] = float(voltage_value)
+            parsed_data["temp.O"], parsed_data["temp.A"] = map(float, temp_values)
+    except ValueError as e:
+        print(f"Error parsing message: {complete_message}. Error: {e}")
+
+    return parsed_data
+
+
+def parse_summary_message(complete_message):
+    """
+    Parses a summary message sent by tags in summary mode,
+    "S:<window s>,<samples>,<accel mag mean>,<accel mag var>,<gyro mag mean>,<gyro mag var>",
+    and returns a dictionary keyed by SUMMARY_FIELDS, or None when it is malformed.
+    """
+    try:
+        values = [float(value) for value in complete_message[len(SUMMARY_PREFIX):].split(",")]
+        if len(values) != len(SUMMARY_FIELDS):
+            raise ValueError(f"expected {len(SUMMARY_FIELDS)} values, got {len(values)}")
+    except ValueError as e:
+        print(f"Error parsing message: {complete_message}. Error: {e}")
+        return None
+
+    summary = dict(zip(SUMMARY_FIELDS, values))
+    summary["samples"] = int(summary["samples"])
+    return summary
+
+
+def advertisement_row(timestamp, device, advertisement_data):
+    date = timestamp.strftime('%Y/%m/%d')
+    time = timestamp.strftime('%H:%M:%S.%f')
+    a = advertisement_data
+    return [date, time, device.address, a.local_name, a.rssi, a.tx_power, a.service_data, a.service_uuids, a.manufacturer_data, a.platform_data]
+
+
+def save_advertisements(rows, filename):
+    """
+    Saves scanned advertisement rows in the layout DataFrame.to_csv/to_excel
+    used to produce. pandas is only needed (and imported) for Excel files.
+    """
+    if filename.endswith(".xlsx"):
+        import pandas as pd
+        pd.DataFrame(rows, columns=ADVERTISEMENT_COLUMNS).to_excel(filename)
+        return
+
+    with open(filename, mode='w', newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow([""] + ADVERTISEMENT_COLUMNS)
+        for index, row in enumerate(rows):
+            writer.writerow([index] + row)
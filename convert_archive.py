@@ -0,0 +1,270 @@
+import argparse
+import csv
+import json
+import os
+import struct
+import sys
+import time
+import zlib
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+from ahm_core import CSV_HEADER
+
+# Header of the hourly CSV files written by receiver_multi.py (no battery.V, address per row)
+LEGACY_CSV_HEADER = ["Date", "Time", "Address", "accel.X", "accel.Y", "accel.Z", "gyro.X", "gyro.Y", "gyro.Z", "temp.O", "temp.A"]
+LAYOUTS = {
+    "legacy": LEGACY_CSV_HEADER,
+    "v2": CSV_HEADER,
+}
+VALUE_FIELDS = CSV_HEADER[3:]
+COLUMNAR_MAGIC = b"AHMCOL1\n"
+MANIFEST_NAME = "convert_manifest.json"
+MANIFEST_SAVE_INTERVAL = 30.0  # Seconds between manifest saves, a rewrite costs a few MB with years of hourly files
+EXTENSIONS = {"columnar": ".ahmc", "parquet": ".parquet"}
+
+
+def detect_layout(header):
+    for layout, expected in LAYOUTS.items():
+        if header == expected:
+            return layout
+    return None
+
+
+def parse_timestamp(date_str, time_str):
+    # Manual slicing is much faster than strptime for '%Y-%m-%d' and '%H:%M:%S.%f'
+    second, _, fraction = time_str[6:].partition('.')
+    moment = datetime(int(date_str[0:4]), int(date_str[5:7]), int(date_str[8:10]),
+                      int(time_str[0:2]), int(time_str[3:5]), int(second), int((fraction + "000000")[:6]))
+    return round(moment.timestamp() * 1000)
+
+
+def read_csv_columns(path):
+    """
+    Reads one receiver CSV file into columns: the timestamp in milliseconds since
+    the epoch and every sensor value as float64, NaN where the row had no value.
+    Returns (layout, device, columns) or (None, None, None) for other CSV files.
+    """
+    with open(path, newline='') as csv_file:
+        reader = csv.reader(csv_file)
+        header = next(reader, None)
+        layout = detect_layout(header)
+        if layout is None:
+            return None, None, None
+
+        fields = header[3:]
+        timestamps = array('q')
+        values = {field: array('d') for field in VALUE_FIELDS}
+        nan = float("nan")
+        device = None
+        for row in reader:
+            if len(row) < len(header):
+                continue  # Torn last line of a file that was being written
+            # Rows with a malformed timestamp or value are skipped as a whole so the columns stay aligned
+            try:
+                timestamp = parse_timestamp(row[0], row[1])
+                row_values = [float(value) if value else nan for value in row[3:len(header)]]
+            except ValueError:
+                continue
+            timestamps.append(timestamp)
+            device = row[2]
+            for field, value in zip(fields, row_values):
+                values[field].append(value)
+        # Columns missing from the layout (battery.V in the legacy one) are all NaN
+        for field in VALUE_FIELDS:
+            if field not in fields:
+                values[field] = array('d', [nan]) * len(timestamps)
+
+    columns = {"timestamp": timestamps}
+    columns.update(values)
+    return layout, device, columns
+
+
+def write_columnar(path, columns, metadata):
+    """
+    Writes the native columnar format: a JSON header followed by one zlib block
+    per column. Timestamps are delta encoded first, which makes them compress to
+    a few bytes per hour of data.
+    """
+    blocks = []
+    descriptions = []
+    for name, values in columns.items():
+        encoding = "raw"
+        if name == "timestamp" and len(values) > 0:
+            values = array('q', [values[0]] + [b - a for a, b in zip(values, values[1:])])
+            encoding = "delta"
+        block = zlib.compress(values.tobytes(), 6)
+        descriptions.append({"name": name, "type": values.typecode, "encoding": encoding, "length": len(block)})
+        blocks.append(block)
+
+    header = json.dumps({"metadata": metadata, "byteorder": sys.byteorder, "columns": descriptions}).encode('utf-8')
+    with open(path, 'wb') as output_file:
+        output_file.write(COLUMNAR_MAGIC)
+        output_file.write(struct.pack("<I", len(header)))
+        output_file.write(header)
+        for block in blocks:
+            output_file.write(block)
+
+
+def read_columnar(path):
+    """Reads a file written by write_columnar, returns (metadata, columns)."""
+    with open(path, 'rb') as input_file:
+        if input_file.read(len(COLUMNAR_MAGIC)) != COLUMNAR_MAGIC:
+            raise ValueError(f"{path} is not a columnar sensor data file")
+        header_length, = struct.unpack("<I", input_file.read(4))
+        header = json.loads(input_file.read(header_length))
+        columns = {}
+        for description in header["columns"]:
+            values = array(description["type"])
+            values.frombytes(zlib.decompress(input_file.read(description["length"])))
+            if header["byteorder"] != sys.byteorder:
+                values.byteswap()
+            if description["encoding"] == "delta":
+                total = 0
+                for index, delta in enumerate(values):
+                    total += delta
+                    values[index] = total
+            columns[description["name"]] = values
+    return header["metadata"], columns
+
+
+def write_parquet(path, columns, metadata):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pa.table({name: pa.array(values) for name, values in columns.items()})
+    table = table.replace_schema_metadata({"ahm": json.dumps(metadata)})
+    pq.write_table(table, path, compression="zstd")
+
+
+def convert_file(source, destination, output_format):
+    """
+    Converts one CSV file, returns (status, rows, source bytes, seconds). The
+    output is written to a temporary file first so an interrupted run never
+    leaves a truncated file that looks converted.
+    """
+    started = time.perf_counter()
+    layout, device, columns = read_csv_columns(source)
+    if layout is None:
+        return "skipped", 0, 0, time.perf_counter() - started
+
+    metadata = {"layout": layout, "device": device, "source": os.path.basename(source)}
+    directory = os.path.dirname(destination)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory, exist_ok=True)
+    temporary = destination + ".tmp"
+    if output_format == "parquet":
+        write_parquet(temporary, columns, metadata)
+    else:
+        write_columnar(temporary, columns, metadata)
+    os.replace(temporary, destination)
+    return "converted", len(columns["timestamp"]), os.path.getsize(source), time.perf_counter() - started
+
+
+def load_manifest(output_dir):
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as manifest_file:
+        return json.load(manifest_file)
+
+
+def save_manifest(output_dir, manifest):
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    with open(path + ".tmp", 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def find_pending(input_dir, output_dir, output_format, manifest, retry_failed=False):
+    """
+    Yields (relative path, source, destination, signature) for the CSV files that
+    are new or changed since they were last converted. Files that failed are only
+    tried again once they change, or with `retry_failed`.
+    """
+    extension = EXTENSIONS[output_format]
+    for root, dirs, files in os.walk(input_dir):
+        dirs.sort()
+        for filename in sorted(files):
+            if not filename.endswith(".csv"):
+                continue
+            source = os.path.join(root, filename)
+            relative = os.path.relpath(source, input_dir)
+            stat = os.stat(source)
+            signature = [stat.st_size, stat.st_mtime_ns, output_format]
+            destination = os.path.join(output_dir, os.path.splitext(relative)[0] + extension)
+            done = manifest.get(relative)
+            if done and done["signature"] == signature:
+                if done["status"] == "skipped" or (done["status"] == "failed" and not retry_failed):
+                    continue
+                if done["status"] == "converted" and os.path.exists(destination):
+                    continue
+            yield relative, source, destination, signature
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert sensor_data CSV archives to compressed columnar files")
+
+    parser.add_argument("input", help="directory with the CSV files, e.g. sensor_data")
+    parser.add_argument("output", help="directory the columnar files are written to")
+    parser.add_argument(
+        "--format",
+        choices=sorted(EXTENSIONS),
+        default="columnar",
+        help="columnar (native, no dependencies, read with read_columnar) or parquet (requires pyarrow) (default: columnar)",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="number of worker processes (default: number of CPUs)",
+    )
+    parser.add_argument(
+        "--retry-failed",
+        action="store_true",
+        help="also convert the files that failed before and have not changed since",
+    )
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.output):
+        os.makedirs(args.output)
+    manifest = load_manifest(args.output)
+    pending = list(find_pending(args.input, args.output, args.format, manifest, args.retry_failed))
+    print(f"{len(pending)} files to convert")
+
+    started = time.perf_counter()
+    last_saved = started
+    total_rows = 0
+    total_bytes = 0
+    # Files converted since the last manifest save are converted again after an interruption, which is harmless
+    try:
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            futures = {executor.submit(convert_file, source, destination, args.format): (relative, signature)
+                       for relative, source, destination, signature in pending}
+            for future in as_completed(futures):
+                relative, signature = futures[future]
+                try:
+                    status, rows, size, seconds = future.result()
+                except Exception as e:
+                    print(f"{relative}: failed: {e}")
+                    status = "failed"
+                else:
+                    if status == "skipped":
+                        print(f"{relative}: skipped, not a receiver CSV file")
+                    else:
+                        total_rows += rows
+                        total_bytes += size
+                        rate = rows / seconds if seconds > 0 else 0.0
+                        print(f"{relative}: {rows} rows in {seconds:.2f} s ({rate:.0f} rows/s, {size / seconds / 1e6 if seconds > 0 else 0.0:.2f} MB/s)")
+                # Skipped and failed files are recorded too so they are not read again until they change
+                manifest[relative] = {"signature": signature, "status": status}
+                if time.perf_counter() - last_saved >= MANIFEST_SAVE_INTERVAL:
+                    save_manifest(args.output, manifest)
+                    last_saved = time.perf_counter()
+    finally:
+        save_manifest(args.output, manifest)
+
+    elapsed = time.perf_counter() - started
+    print(f"Converted {total_rows} rows ({total_bytes / 1e6:.1f} MB of CSV) in {elapsed:.1f} s")
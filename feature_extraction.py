@@ -0,0 +1,223 @@
+import csv
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+
+MOTION_FIELDS = ["accel.X", "accel.Y", "accel.Z", "gyro.X", "gyro.Y", "gyro.Z"]
+FEATURE_HEADER = ["Date", "Time", "Device Name", "samples", "rate.Hz",
+                  "accel.mag.mean", "accel.mag.var", "gyro.mag.mean", "gyro.mag.var",
+                  "peaks", "rumination.power", "dominant.Hz", "temp.O", "temp.A", "battery.V"]
+DECIMATED_HEADER = ["Date", "Time", "Device Name"] + MOTION_FIELDS
+
+
+class FeatureExtractor:
+    """
+    Collects the accel/gyro samples of one device into a preallocated window and
+    computes per-window activity features with NumPy.
+
+    Features are the mean and variance of the accel and gyro magnitude, the number
+    of step-like peaks in the accel magnitude, the fraction of accel power inside
+    the rumination band and the dominant frequency. The spectrum assumes roughly
+    uniform sampling, the sample rate is estimated from the receive timestamps.
+    """
+
+    def __init__(self, window_seconds=10.0, max_rate_hz=200.0, peak_threshold=1.5,
+                 rumination_band=(0.5, 1.5), decimation=1, anti_alias=True):
+        self.window_seconds = window_seconds
+        self.peak_threshold = peak_threshold  # Peaks must exceed mean + threshold * std
+        self.rumination_band = rumination_band  # Jaw movement band in Hz
+        self.decimation = decimation  # Keep one decimated sample every `decimation` samples, 1 disables it
+        self.anti_alias = anti_alias  # Average each block instead of picking one sample
+        capacity = int(window_seconds * max_rate_hz) + 1
+        self.times = np.empty(capacity)
+        self.samples = np.empty((capacity, len(MOTION_FIELDS)))
+        self.count = 0
+        self.window_start = None
+        self.latest = {"temp.O": "", "temp.A": "", "battery.V": ""}
+
+    def add(self, timestamp, parsed_data):
+        """
+        Adds one parsed message. Returns the (features, decimated) tuple of the
+        window it closed, or None while the window is still filling.
+        """
+        for key in self.latest:
+            if parsed_data[key] != "":
+                self.latest[key] = parsed_data[key]
+
+        # Messages without accel/gyro, or with a truncated part, are not motion samples
+        if any(parsed_data[key] == "" for key in MOTION_FIELDS):
+            return None
+
+        t = timestamp.timestamp()
+        result = None
+        if self.window_start is None:
+            self.window_start = t
+        elif t - self.window_start >= self.window_seconds or self.count == len(self.times):
+            result = self.flush()
+            self.window_start = t
+
+        self.times[self.count] = t
+        self.samples[self.count] = [parsed_data[key] for key in MOTION_FIELDS]
+        self.count += 1
+        return result
+
+    def flush(self):
+        """Computes the features of the current window and starts a new one."""
+        if self.count == 0:
+            return None
+        features = self.compute_features()
+        decimated = self.downsample()
+        self.count = 0
+        self.window_start = None
+        return features, decimated
+
+    def compute_features(self):
+        n = self.count
+        t = self.times[:n]
+        x = self.samples[:n]
+        accel_mag = np.linalg.norm(x[:, :3], axis=1)
+        gyro_mag = np.linalg.norm(x[:, 3:], axis=1)
+
+        duration = t[-1] - t[0]
+        rate = (n - 1) / duration if duration > 0 else 0.0
+
+        # Step-like peaks: local maxima of the accel magnitude well above its mean
+        centered = accel_mag - accel_mag.mean()
+        threshold = self.peak_threshold * centered.std()
+        middle = centered[1:-1]
+        peaks = int(np.count_nonzero((middle > centered[:-2]) & (middle >= centered[2:]) & (middle > threshold)))
+
+        rumination_power = ""
+        dominant = ""
+        if n >= 8 and rate > 0:
+            spectrum = np.abs(np.fft.rfft(centered * np.hanning(n))) ** 2
+            freqs = np.fft.rfftfreq(n, 1.0 / rate)
+            total = spectrum[1:].sum()
+            if total > 0:
+                low, high = self.rumination_band
+                band = (freqs >= low) & (freqs <= high)
+                rumination_power = float(spectrum[band].sum() / total)
+                dominant = float(freqs[1 + np.argmax(spectrum[1:])])
+
+        return {
+            "start": self.window_start,
+            "samples": n,
+            "rate.Hz": rate,
+            "accel.mag.mean": float(accel_mag.mean()),
+            "accel.mag.var": float(accel_mag.var()),
+            "gyro.mag.mean": float(gyro_mag.mean()),
+            "gyro.mag.var": float(gyro_mag.var()),
+            "peaks": peaks,
+            "rumination.power": rumination_power,
+            "dominant.Hz": dominant,
+            "temp.O": self.latest["temp.O"],
+            "temp.A": self.latest["temp.A"],
+            "battery.V": self.latest["battery.V"],
+        }
+
+    def downsample(self):
+        """Returns (times, samples) reduced by the decimation factor, or None when disabled."""
+        q = self.decimation
+        if q <= 1:
+            return None
+        n = self.count - self.count % q
+        if n == 0:
+            return None
+        if self.anti_alias:
+            # Block averaging is a boxcar low-pass filter followed by decimation
+            times = self.times[:n].reshape(-1, q).mean(axis=1)
+            samples = self.samples[:n].reshape(-1, q, len(MOTION_FIELDS)).mean(axis=1)
+        else:
+            times = self.times[:n:q]
+            samples = self.samples[:n:q]
+        return times, samples
+
+
+class FeatureStream:
+    """
+    Secondary storage stream for one device: writes the window features (and the
+    decimated samples, when enabled) to hourly CSV files next to the raw data.
+    """
+
+    def __init__(self, device_name, extractor, base_dir="sensor_data"):
+        self.device_name = device_name
+        self.extractor = extractor
+        self.sanitized_device_name = device_name.replace(" ", "_").replace(":", "_")
+        self.base_path = os.path.join(base_dir, self.sanitized_device_name, "features")
+        self.file_timestamp = None
+        self.feature_writer, self.feature_file = None, None
+        self.decimated_writer, self.decimated_file = None, None
+
+    def _open(self, suffix, header):
+        if not os.path.exists(self.base_path):
+            os.makedirs(self.base_path)
+        filename = f"{self.sanitized_device_name}_{suffix}_{self.file_timestamp.strftime('%Y%m%d_%H%M%S')}.csv"
+        csv_file = open(os.path.join(self.base_path, filename), mode='w', newline='')
+        writer = csv.writer(csv_file)
+        writer.writerow(header)
+        return writer, csv_file
+
+    def _rotate_if_needed(self):
+        now = datetime.now()
+        if self.file_timestamp is not None and now - self.file_timestamp < timedelta(hours=1):
+            return
+        self.close_files()
+        self.file_timestamp = now
+        self.feature_writer, self.feature_file = self._open("features", FEATURE_HEADER)
+        if self.extractor.decimation > 1:
+            self.decimated_writer, self.decimated_file = self._open("decimated", DECIMATED_HEADER)
+
+    def add(self, timestamp, parsed_data):
+        result = self.extractor.add(timestamp, parsed_data)
+        if result is not None:
+            self.write(*result)
+
+    def add_summary(self, timestamp, summary):
+        """
+        Writes a window summarized by the tag itself (summary mode) as a feature
+        row ending at `timestamp`. The other features need the samples and are
+        left empty.
+        """
+        window = summary["window.s"]
+        features = {
+            "start": timestamp.timestamp() - window,
+            "samples": summary["samples"],
+            "rate.Hz": summary["samples"] / window if window > 0 else 0.0,
+            "accel.mag.mean": summary["accel.mag.mean"],
+            "accel.mag.var": summary["accel.mag.var"],
+            "gyro.mag.mean": summary["gyro.mag.mean"],
+            "gyro.mag.var": summary["gyro.mag.var"],
+            "peaks": "",
+            "rumination.power": "",
+            "dominant.Hz": "",
+        }
+        features.update(self.extractor.latest)
+        self.write(features, None)
+
+    def write(self, features, decimated):
+        self._rotate_if_needed()
+        start = datetime.fromtimestamp(features.pop("start"))
+        values = [round(v, 6) if isinstance(v, float) else v for v in features.values()]
+        self.feature_writer.writerow([start.strftime('%Y-%m-%d'), start.strftime('%H:%M:%S.%f')[:-3], self.device_name] + values)
+        self.feature_file.flush()
+
+        if decimated is not None:
+            times, samples = decimated
+            for t, values in zip(times, samples):
+                stamp = datetime.fromtimestamp(t)
+                self.decimated_writer.writerow([stamp.strftime('%Y-%m-%d'), stamp.strftime('%H:%M:%S.%f')[:-3], self.device_name] + [round(v, 4) for v in values.tolist()])
+            self.decimated_file.flush()
+
+    def close_files(self):
+        for csv_file in (self.feature_file, self.decimated_file):
+            if csv_file is not None and not csv_file.closed:
+                csv_file.close()
+        self.feature_file = self.decimated_file = None
+
+    def close(self):
+        """Writes the partial window and closes the files."""
+        result = self.extractor.flush()
+        if result is not None:
+            self.write(*result)
+        self.close_files()
@@ -0,0 +1,128 @@
+import asyncio
+import os
+import struct
+import zlib
+from datetime import datetime
+
+RECORD_MAGIC = b"AJ"
+RECORD_HEADER = struct.Struct("<2sII")  # Magic, payload length, CRC32 of the payload
+FRAME_HEADER = struct.Struct("<dBBH")  # Timestamp, address length, name length, data length
+
+
+def fsync_file(file):
+    file.flush()
+    os.fsync(file.fileno())
+
+
+def encode_frames(frames):
+    parts = []
+    for device_address, device_name, timestamp, data in frames:
+        address = device_address.encode('utf-8')
+        name = device_name.encode('utf-8')
+        parts.append(FRAME_HEADER.pack(timestamp.timestamp(), len(address), len(name), len(data)))
+        parts.extend((address, name, data))
+    return b"".join(parts)
+
+
+def decode_frames(payload):
+    frames = []
+    offset = 0
+    while offset < len(payload):
+        timestamp, address_length, name_length, data_length = FRAME_HEADER.unpack_from(payload, offset)
+        offset += FRAME_HEADER.size
+        address = payload[offset:offset + address_length].decode('utf-8')
+        offset += address_length
+        name = payload[offset:offset + name_length].decode('utf-8')
+        offset += name_length
+        data = payload[offset:offset + data_length]
+        offset += data_length
+        frames.append((address, name, datetime.fromtimestamp(timestamp), data))
+    return frames
+
+
+def read_journal(path):
+    """
+    Yields the (device_address, device_name, timestamp, data) frames stored in a
+    journal. Reading stops at the first torn or corrupt record, which is what a
+    power cut in the middle of a write leaves behind.
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb') as journal_file:
+        while True:
+            header = journal_file.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            magic, length, crc = RECORD_HEADER.unpack(header)
+            payload = journal_file.read(length)
+            if magic != RECORD_MAGIC or len(payload) < length or zlib.crc32(payload) != crc:
+                print(f"Journal {path}: ignoring corrupt tail at offset {journal_file.tell() - len(payload) - len(header)}")
+                return
+            for frame in decode_frames(payload):
+                yield frame
+
+
+class Journal:
+    """
+    Append-only, checksummed write-ahead journal of the raw notifications.
+
+    Frames are batched in memory and written as one CRC32-protected record and
+    fsynced every `fsync_interval` seconds. Once the CSV files holding those frames
+    are synced the journal is checkpointed: it is truncated and only the
+    incomplete messages still waiting in the reassembly buffers are kept. After a
+    crash, the frames since the last checkpoint are replayed into the CSV files,
+    so rows written but not yet checkpointed before the crash can appear twice.
+    """
+
+    def __init__(self, path, fsync_interval=1.0):
+        self.path = path
+        self.fsync_interval = fsync_interval
+        self.pending = []  # Frames not yet written to the journal file
+        self.names = {}  # Last device name seen for each device address
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.file = open(path, 'ab')
+
+    def append(self, device_address, device_name, timestamp, data):
+        self.names[device_address] = device_name
+        self.pending.append((device_address, device_name, timestamp, data))
+
+    def _write(self, frames):
+        payload = encode_frames(frames)
+        self.file.write(RECORD_HEADER.pack(RECORD_MAGIC, len(payload), zlib.crc32(payload)))
+        self.file.write(payload)
+
+    def sync(self):
+        if self.pending:
+            self._write(self.pending)
+            self.pending = []
+        fsync_file(self.file)
+
+    def checkpoint(self, buffers):
+        """
+        Drops everything journaled so far. Must only be called once all the
+        journaled frames are in synced CSV files, `buffers` are the incomplete
+        messages that still have to survive a crash.
+        """
+        self.pending = []
+        self.file.seek(0)
+        self.file.truncate()
+        now = datetime.now()
+        partial = [(address, self.names.get(address, address), now, buffer.encode('utf-8'))
+                   for address, buffer in buffers.items() if buffer]
+        if partial:
+            self._write(partial)
+        fsync_file(self.file)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.fsync_interval)
+            self.sync()
+
+    def close(self, truncate=False):
+        if truncate:
+            self.checkpoint({})
+        else:
+            self.sync()
+        self.file.close()
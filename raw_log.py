@@ -0,0 +1,98 @@
+import asyncio
+import struct
+import time
+from datetime import datetime, timedelta
+
+FILE_MAGIC = b"AHMRAW1\n"  # Starts every recording session, a restarted receiver appends a new one
+FILE_HEADER = struct.Struct("<dq")  # Wall clock and monotonic clock (ns) when the session was started
+DEVICE_RECORD = struct.Struct("<cHBB")  # b"D", device id, address length, name length
+FRAME_RECORD = struct.Struct("<cHqH")  # b"F", device id, monotonic clock (ns), data length
+
+
+class RawLogWriter:
+    """
+    Records the raw notification stream (device, monotonic timestamp, bytes) in
+    a compact binary log that replay_raw_log.py can push through the pipeline.
+
+    Each device is described once by a "D" record, frames then only carry the
+    device id, so a frame costs 13 bytes on top of its data. An existing log is
+    appended to as a new session, so restarting a receiver keeps the earlier
+    recordings.
+    """
+
+    def __init__(self, path, flush_interval=1.0):
+        self.path = path
+        self.flush_interval = flush_interval  # Seconds between flushes by run(), bounds what a killed receiver loses
+        self.device_ids = {}
+        self.file = open(path, 'ab')
+        self.file.write(FILE_MAGIC)
+        self.file.write(FILE_HEADER.pack(time.time(), time.monotonic_ns()))
+
+    def record(self, device_address, device_name, data):
+        timestamp = time.monotonic_ns()
+        device_id = self.device_ids.get(device_address)
+        if device_id is None:
+            device_id = self.device_ids[device_address] = len(self.device_ids)
+            address = device_address.encode('utf-8')
+            name = device_name.encode('utf-8')
+            self.file.write(DEVICE_RECORD.pack(b"D", device_id, len(address), len(name)) + address + name)
+        self.file.write(FRAME_RECORD.pack(b"F", device_id, timestamp, len(data)) + data)
+
+    def flush(self):
+        self.file.flush()
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            self.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def read_raw_log(path):
+    """
+    Yields (device_address, device_name, offset, timestamp, data) for every frame
+    of a raw log, where offset is the number of seconds since the frame's
+    session was started and timestamp the wall clock time the frame was
+    received. A truncated last record is ignored.
+    """
+    devices = None  # (address, name) by device id, None before the first session header
+    with open(path, 'rb') as log_file:
+        while True:
+            kind = log_file.read(1)
+            if not kind:
+                return
+            if devices is None and kind != FILE_MAGIC[:1]:
+                raise ValueError(f"{path} is not a raw notification log")
+            if kind == FILE_MAGIC[:1]:
+                # A new session, device ids start again
+                if log_file.read(len(FILE_MAGIC) - 1) != FILE_MAGIC[1:]:
+                    raise ValueError(f"{path}: corrupt session header at offset {log_file.tell()}")
+                header = log_file.read(FILE_HEADER.size)
+                if len(header) < FILE_HEADER.size:
+                    return
+                start_wall, start_monotonic = FILE_HEADER.unpack(header)
+                start = datetime.fromtimestamp(start_wall)
+                devices = {}
+            elif kind == b"D":
+                header = log_file.read(DEVICE_RECORD.size - 1)
+                if len(header) < DEVICE_RECORD.size - 1:
+                    return
+                _, device_id, address_length, name_length = DEVICE_RECORD.unpack(kind + header)
+                address = log_file.read(address_length).decode('utf-8')
+                name = log_file.read(name_length).decode('utf-8')
+                devices[device_id] = (address, name)
+            elif kind == b"F":
+                header = log_file.read(FRAME_RECORD.size - 1)
+                if len(header) < FRAME_RECORD.size - 1:
+                    return
+                _, device_id, timestamp, length = FRAME_RECORD.unpack(kind + header)
+                data = log_file.read(length)
+                if len(data) < length:
+                    return
+                offset = (timestamp - start_monotonic) / 1e9
+                address, name = devices[device_id]
+                yield address, name, offset, start + timedelta(seconds=offset), data
+            else:
+                raise ValueError(f"{path}: unknown record type {kind!r} at offset {log_file.tell() - 1}")
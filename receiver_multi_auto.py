@@ -1,28 +1,54 @@
+import argparse
 import asyncio
-from bleak import BleakClient, BleakScanner
+from bleak import BleakClient
 from datetime import datetime, timedelta
-import signal
-import sys
 import os
 import csv
 
-# Nordic UART Service (NUS) UUIDs
-NUS_SERVICE_UUID = "6e400001-b5a3-f393-e0a9-e50e24dcca9e"
-NUS_RX_UUID = "6e400002-b5a3-f393-e0a9-e50e24dcca9e"
-NUS_TX_UUID = "6e400003-b5a3-f393-e0a9-e50e24dcca9e"
-DEVICE_NAME_SUBSTRING = "AHM_PANDEY_LAB"
+from ahm_core import CSV_HEADER, DEVICE_NAME_SUBSTRING, NUS_RX_UUID, NUS_TX_UUID, SUMMARY_PREFIX, parse_complete_message, parse_summary_message, startup_mark
+from journal import Journal, fsync_file, read_journal
+from raw_log import RawLogWriter
+from ring_cache import RingCache, serve_queries
+from scan_scheduler import ScanScheduler
+from shutdown_coordinator import ShutdownCoordinator
+from tag_control import TagController
+
+SENSOR_DATA_DIR = "sensor_data"
 
 clients = {}  # Dictionary of clients to access during shutdown
 buffers = {}  # Buffer dictionary to store incomplete messages for each device
 csv_writers = {}  # Dictionary to store CSV writers for each device
 csv_files = {}  # Dictionary to store file objects for each device
 connected_devices = []  # List to track connected devices
+rx_queue = None  # Queue of received notifications waiting to be parsed and written, created in main()
+rx_in_flight = 0  # Notifications taken off rx_queue and not processed yet
+shutdown = None  # ShutdownCoordinator, created in main()
+create_feature_stream = None  # Creates the FeatureStream of a device, set in main() when --features is given
+feature_streams = {}  # Dictionary to store the feature stream of each device
+journal = None  # Write-ahead Journal, set in main() when --journal is given
+raw_log = None  # RawLogWriter, set in main() when --record-raw is given
+ring_cache = None  # RingCache of the recent samples, set in main() when --cache-minutes is given
+control_options = None  # TagController keyword arguments, set in main() when --rate-control is given
+tag_controllers = {}  # Dictionary to store the TagController of each device, kept across reconnects
+scan_scheduler = None  # ScanScheduler, created in main()
+
+def close_csv_file(csv_file):
+    if journal is not None:
+        # The journal may be cut at the next checkpoint, the file has to be on disk by then
+        fsync_file(csv_file)
+    csv_file.close()
 
 async def disconnect_all():
-    for address, client in clients.items():
+    for address, client in list(clients.items()):
         if client.is_connected:
             await client.disconnect()
             print(f"Disconnected from {address}")
+    # Let queued frames, including the ones received while disconnecting, reach the files before the buffers are cleared
+    await rx_queue.join()
+    for csv_file in csv_files.values():
+        close_csv_file(csv_file)
+    csv_files.clear()
+    csv_writers.clear()
     clients.clear()
     buffers.clear()
     connected_devices.clear()
@@ -32,7 +58,7 @@ def create_csv_writer(device_name, device_address):
 
     # Create the directory for sensor data
     sanitized_device_name = device_name.replace(" ", "_").replace(":", "_")
-    base_path = os.path.join("sensor_data", sanitized_device_name)
+    base_path = os.path.join(SENSOR_DATA_DIR, sanitized_device_name)
     if not os.path.exists(base_path):
         os.makedirs(base_path)
 
@@ -40,66 +66,149 @@ def create_csv_writer(device_name, device_address):
     filename = f"{sanitized_device_name}_{current_time.strftime('%Y%m%d_%H')}.csv"
     filepath = os.path.join(base_path, filename)
 
-    csv_file = open(filepath, mode='w', newline='')
+    # Append so reconnecting (or replaying the journal) within the same hour keeps earlier rows
+    new_file = not os.path.exists(filepath)
+    csv_file = open(filepath, mode='a', newline='')
     writer = csv.writer(csv_file)
 
     # Write header
-    writer.writerow(["Date", "Time", "Device Name", "accel.X", "accel.Y", "accel.Z", "gyro.X", "gyro.Y", "gyro.Z", "temp.O", "temp.A", "battery.V"])
+    if new_file:
+        writer.writerow(CSV_HEADER)
     return writer, csv_file
 
 
-def parse_complete_message(complete_message):
-    parsed_data = {
-        "accel.X": "",
-        "accel.Y": "",
-        "accel.Z": "",
-        "gyro.X": "",
-        "gyro.Y": "",
-        "gyro.Z": "",
-        "temp.O": "",
-        "temp.A": "",
-        "battery.V": ""
-    }
+def process_secondary(device_address, device_name, timestamp, parsed_data):
+    # The raw row is already written, a failure here must not lose it or the messages after it
+    try:
+        if device_address in feature_streams:
+            feature_streams[device_address].add(timestamp, parsed_data)
+        if ring_cache is not None:
+            ring_cache.add(device_address, device_name, timestamp.timestamp(), parsed_data)
+        if device_address in tag_controllers:
+            tag_controllers[device_address].observe(parsed_data)
+    except Exception as e:
+        print(f"Error processing message from {device_name}: {e}")
+
 
+def process_summary(device_address, device_name, timestamp, summary):
+    # Summaries are window statistics, not samples, they go to the feature files instead of the raw CSV
     try:
-        if "A:" in complete_message and ";G:" in complete_message:
-            accel_part, gyro_part = complete_message.split(";G:")
-            _, accel_values = accel_part.split("A:")
-            parsed_data["accel.X"], parsed_data["accel.Y"], parsed_data["accel.Z"] = map(float, accel_values.split(","))
-            parsed_data["gyro.X"], parsed_data["gyro.Y"], parsed_data["gyro.Z"] = map(float, gyro_part.split(","))
+        if device_address in feature_streams:
+            feature_streams[device_address].add_summary(timestamp, summary)
+        if device_address in tag_controllers:
+            tag_controllers[device_address].observe_summary(summary)
+    except Exception as e:
+        print(f"Error processing summary from {device_name}: {e}")
+
+
+def process_frame(device_address, device_name, timestamp, data):
+    date_str = timestamp.strftime('%Y-%m-%d')
+    time_str = timestamp.strftime('%H:%M:%S.%f')[:-3]  # Include milliseconds in timestamp
+    message = data.decode('utf-8')
+    buffers[device_address] += message
+
+    # Handle every complete message in the buffer, each one ends with an underscore
+    while '_' in buffers[device_address]:
+        complete_message, remaining = buffers[device_address].split('_', 1)
+        buffers[device_address] = remaining
+
+        if complete_message.startswith(SUMMARY_PREFIX):
+            print(f"[{device_name}] {complete_message}")
+            summary = parse_summary_message(complete_message)
+            if summary is not None:
+                process_summary(device_address, device_name, timestamp, summary)
+            continue
+
+        parsed_data = parse_complete_message(complete_message)
+        writer, csv_file = csv_writers[device_address], csv_files[device_address]
+        row = [date_str, time_str, device_name] + list(parsed_data.values())
+        writer.writerow(row)
+        if journal is None:
+            csv_file.flush()
+        process_secondary(device_address, device_name, timestamp, parsed_data)
+
+        # Print received data for visibility
+        print(f"[{device_name}] {row}")
 
-        if "V:" in complete_message and ";T:" in complete_message:
-            voltage_part, temp_part = complete_message.split(";T:")
-            _, voltage_value = voltage_part.split("V:")
-            temp_values = temp_part.split(",")
-            parsed_data["battery.V"] = float(voltage_value)
-            parsed_data["temp.O"], parsed_data["temp.A"] = map(float, temp_values)
-    except ValueError as e:
-        print(f"Error parsing message: {complete_message}. Error: {e}")
 
-    return parsed_data
+async def process_rx_queue():
+    global rx_in_flight
+    while True:
+        device_address, device_name, timestamp, data = await rx_queue.get()
+        rx_in_flight += 1
+        try:
+            process_frame(device_address, device_name, timestamp, data)
+        except Exception as e:
+            print(f"Error processing data from {device_name}: {e}")
+        finally:
+            rx_in_flight -= 1
+            rx_queue.task_done()
+
+
+def replay_journal(journal_path):
+    """
+    Writes the frames left in the journal by a previous run to the CSV files.
+    """
+    count = 0
+    for device_address, device_name, timestamp, data in read_journal(journal_path):
+        if device_address not in csv_writers:
+            buffers[device_address] = ""
+            csv_writers[device_address], csv_files[device_address] = create_csv_writer(device_name, device_address)
+            if create_feature_stream is not None:
+                feature_streams[device_address] = create_feature_stream(device_name)
+        process_frame(device_address, device_name, timestamp, data)
+        count += 1
+
+    for csv_file in csv_files.values():
+        fsync_file(csv_file)
+        csv_file.close()
+    csv_writers.clear()
+    csv_files.clear()
+    buffers.clear()
+    if count:
+        print(f"Recovered {count} frames from journal {journal_path}")
+
+
+async def checkpoint_journal(interval):
+    while True:
+        await asyncio.sleep(interval)
+        # Every journaled frame has to be in a synced CSV file before the journal is cut.
+        # handle_rx can queue (and journal) new frames before join() returns here, so
+        # the queue is checked again in the same step as the sync and the truncation.
+        await rx_queue.join()
+        while not rx_queue.empty():
+            await rx_queue.join()
+        for csv_file in csv_files.values():
+            if not csv_file.closed:
+                fsync_file(csv_file)
+        journal.checkpoint(buffers)
+
+
+async def control_tags(interval):
+    while True:
+        await asyncio.sleep(interval)
+        for address, controller in list(tag_controllers.items()):
+            if controller.client.is_connected:
+                try:
+                    await controller.adjust(rx_queue.qsize())
+                except Exception as e:
+                    print(f"Failed to adjust streaming of {address}: {e}")
 
 
 def create_handle_rx(device_address, device_name):
     async def handle_rx(sender: str, data: bytearray):
+        startup_mark("first_notification")
         timestamp = datetime.now()
-        date_str = timestamp.strftime('%Y-%m-%d')
-        time_str = timestamp.strftime('%H:%M:%S.%f')[:-3]  # Include milliseconds in timestamp
-        message = data.decode('utf-8')
-        buffers[device_address] += message
-
-        if '_' in buffers[device_address]:
-            complete_message, remaining = buffers[device_address].split('_', 1)
-            buffers[device_address] = remaining
-
-            parsed_data = parse_complete_message(complete_message)
-            writer, csv_file = csv_writers[device_address], csv_files[device_address]
-            row = [date_str, time_str, device_name] + list(parsed_data.values())
-            writer.writerow(row)
-            csv_file.flush()
+        data = bytes(data)
+        if journal is not None:
+            journal.append(device_address, device_name, timestamp, data)
+        if raw_log is not None:
+            raw_log.record(device_address, device_name, data)
 
-            # Print received data for visibility
-            print(f"[{device_name}] {row}")
+        scan_scheduler.record_rx(len(data))
+
+        # Parsing and writing happen in process_rx_queue so they can be drained on shutdown
+        rx_queue.put_nowait((device_address, device_name, timestamp, data))
 
     return handle_rx
 
@@ -112,45 +221,250 @@ async def connect_and_init_device(device, device_name):
     client = BleakClient(device.address)
     try:
         await client.connect()
+        # Registered right away so a shutdown during the setup below still terminates the tag
+        clients[client.address] = client
+        connected_devices.append(client.address)
         buffers[client.address] = ""
         writer, csv_file = create_csv_writer(device_name, client.address)
         csv_writers[client.address], csv_files[client.address] = writer, csv_file
 
+        if create_feature_stream is not None and client.address not in feature_streams:
+            feature_streams[client.address] = create_feature_stream(device_name)
+
         await client.write_gatt_char(NUS_RX_UUID, b"I")
         await client.start_notify(NUS_TX_UUID, create_handle_rx(client.address, device_name))
+        if control_options is not None:
+            if client.address in tag_controllers:
+                # A reconnecting tag keeps its level, idle and battery state
+                await tag_controllers[client.address].reconnect(client)
+            else:
+                tag_controllers[client.address] = TagController(client, device_name, **control_options)
 
-        clients[client.address] = client
-        connected_devices.append(client.address)
         print(f"Connected to {device.name} ({device.address})")
         return client
     except Exception as e:
         print(f"Failed to connect to {device.address}: {e}")
+        if clients.get(client.address) is client:
+            del clients[client.address]
+            connected_devices.remove(client.address)
+            if client.address in csv_files:
+                csv_writers.pop(client.address)
+                close_csv_file(csv_files.pop(client.address))
+            if client.is_connected:
+                await client.disconnect()
 
     return None
 
 
+async def forget_dropped_links():
+    dropped = [address for address, client in clients.items() if not client.is_connected]
+    if not dropped:
+        return
+    # Let queued frames reach the files before closing them
+    await rx_queue.join()
+    for address in dropped:
+        print(f"Lost connection to {address}")
+        del clients[address]
+        connected_devices.remove(address)
+        close_csv_file(csv_files.pop(address))
+        csv_writers.pop(address)
+
+
 async def scan_and_connect():
-    print("Scanning for devices...")
-    devices = await BleakScanner.discover()
-    for device in devices:
-        if DEVICE_NAME_SUBSTRING in (device.name or "") and device.address not in clients:
-            await connect_and_init_device(device, device.name)
+    """Scans if the scheduler allows it and returns the seconds to wait before the next scan."""
+    # The scheduler needs the links that are really active
+    await forget_dropped_links()
+    plan = scan_scheduler.plan(connected_devices)
+    if plan is None:
+        # Every tag is connected, keep the radio for the links
+        return scan_scheduler.check_interval
+
+    window, pause = plan
+    print(f"Scanning for devices ({window:.0f} s)...")
+    devices = await scan_scheduler.scan(window, connected_devices)
+    for device, device_name in devices:
+        if device.address not in clients:
+            await connect_and_init_device(device, device_name)
+    print(scan_scheduler.report())
+    return pause
+
+
+def ten_minute_slot(current_time):
+    return current_time.replace(minute=current_time.minute - current_time.minute % 10, second=0, microsecond=0)
 
 
 async def periodic_disconnect_and_scan():
+    last_disconnect = ten_minute_slot(datetime.now())
     while True:
-        current_time = datetime.now()
-        if current_time.minute % 10 == 0:
-            print("Performing scheduled disconnect and scan...")
+        # Disconnect once every new 10 minute slot
+        slot = ten_minute_slot(datetime.now())
+        if slot != last_disconnect:
+            print("Performing scheduled disconnect...")
+            last_disconnect = slot
             await disconnect_all()
-            await scan_and_connect()
-        await asyncio.sleep(60)  # Check every minute
-
-
-async def main():
-    signal.signal(signal.SIGINT, lambda s, f: sys.exit(0))
-    await periodic_disconnect_and_scan()
+        # Scan as often as the scheduler allows between the scheduled disconnects
+        pause = await scan_and_connect()
+        # Scan pauses can be longer than a slot, wake up for the next scheduled disconnect
+        resume = datetime.now() + timedelta(seconds=pause)
+        while datetime.now() < resume and ten_minute_slot(datetime.now()) == last_disconnect:
+            await asyncio.sleep(min((resume - datetime.now()).total_seconds(), 1.0))
+
+
+async def main(args):
+    global rx_queue, shutdown, create_feature_stream, journal, raw_log, ring_cache, control_options, scan_scheduler
+    startup_mark("imported")
+    if args.features:
+        # Imported here so a missing NumPy stops the receiver at startup instead of failing every connection
+        from feature_extraction import FeatureExtractor, FeatureStream
+        feature_options = dict(window_seconds=args.feature_window, decimation=args.decimate, anti_alias=not args.no_anti_alias)
+
+        def create_feature_stream(device_name):
+            return FeatureStream(device_name, FeatureExtractor(**feature_options), SENSOR_DATA_DIR)
+
+    if args.journal:
+        replay_journal(args.journal)
+        journal = Journal(args.journal, fsync_interval=args.fsync_interval)
+        # The replayed frames are in synced CSV files, they must not be replayed again after another crash
+        journal.checkpoint({})
+
+    if args.record_raw:
+        raw_log = RawLogWriter(args.record_raw)
+
+    registered = [address.strip() for address in args.registered.split(',')] if args.registered else None
+    scan_scheduler = ScanScheduler(DEVICE_NAME_SUBSTRING, registered=registered)
+
+    if args.cache_minutes > 0:
+        ring_cache = RingCache(args.cache_minutes, args.cache_rate)
+
+    if args.rate_control:
+        # Summaries are stored in the feature files, the summary level needs --features
+        control_options = dict(max_rate_hz=args.max_rate, summary=args.features)
+
+    rx_queue = asyncio.Queue()
+    shutdown = ShutdownCoordinator(NUS_RX_UUID, NUS_TX_UUID, b"T")
+    shutdown.add_queue("rx", rx_queue, lambda: rx_in_flight)
+    shutdown.install()
+
+    worker = asyncio.ensure_future(process_rx_queue())
+    if control_options is not None:
+        # Stopped with the intake so no command races the termination command
+        shutdown.add_task(asyncio.ensure_future(control_tags(args.control_interval)))
+    if ring_cache is not None:
+        query_server = asyncio.ensure_future(serve_queries(ring_cache, args.query_port))
+    if raw_log is not None:
+        raw_log_task = asyncio.ensure_future(raw_log.run())
+    if journal is not None:
+        journal_tasks = [asyncio.ensure_future(journal.run()), asyncio.ensure_future(checkpoint_journal(args.checkpoint_interval))]
+    shutdown.add_task(asyncio.ensure_future(periodic_disconnect_and_scan()))
+
+    await shutdown.wait()
+    await shutdown.shutdown(clients.values(), csv_files, buffers)
+    print(scan_scheduler.report())
+    for stream in feature_streams.values():
+        stream.close()
+    worker.cancel()
+    if ring_cache is not None:
+        query_server.cancel()
+    if journal is not None:
+        for task in journal_tasks:
+            task.cancel()
+        # Keep the journal for the next start if the drain deadline left frames behind
+        journal.close(truncate=rx_queue.empty())
+    if raw_log is not None:
+        raw_log_task.cancel()
+        raw_log.close()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--features",
+        action="store_true",
+        help="also store per-window activity features in sensor_data/<device>/features (requires NumPy)",
+    )
+    parser.add_argument(
+        "--feature-window",
+        type=float,
+        default=10.0,
+        help="feature window length in seconds (default: 10)",
+    )
+    parser.add_argument(
+        "--decimate",
+        type=int,
+        default=1,
+        help="with --features, also store accel/gyro downsampled by this factor (default: 1, disabled)",
+    )
+    parser.add_argument(
+        "--no-anti-alias",
+        action="store_true",
+        help="decimate by picking samples instead of averaging each block",
+    )
+
+    parser.add_argument(
+        "--journal",
+        help="write-ahead journal file, frames are synced to it instead of flushing every CSV row and replayed on the next start",
+    )
+    parser.add_argument(
+        "--fsync-interval",
+        type=float,
+        default=1.0,
+        help="seconds between journal syncs (default: 1)",
+    )
+    parser.add_argument(
+        "--checkpoint-interval",
+        type=float,
+        default=60.0,
+        help="seconds between CSV syncs that allow the journal to be truncated (default: 60)",
+    )
+
+    parser.add_argument(
+        "--record-raw",
+        help="also record the raw notification stream to this file, see replay_raw_log.py",
+    )
+
+    parser.add_argument(
+        "--registered",
+        help="comma separated addresses of the tags to collect, scanning stops while they are all connected",
+    )
+
+    parser.add_argument(
+        "--cache-minutes",
+        type=float,
+        default=0,
+        help="keep the last minutes of samples of every device in memory (about 90 bytes per sample, 5.4 MB per device for 10 minutes at 100 Hz) and serve queries on --query-port (default: 0, disabled)",
+    )
+    parser.add_argument(
+        "--cache-rate",
+        type=float,
+        default=100.0,
+        help="highest sample rate per device in Hz, sizes the cache (default: 100)",
+    )
+    parser.add_argument(
+        "--query-port",
+        type=int,
+        default=8765,
+        help="local TCP port of the cache query API (default: 8765)",
+    )
+
+    parser.add_argument(
+        "--rate-control",
+        action="store_true",
+        help="adapt each tag's reporting rate, mode and batching to the host queue, link quality and battery (requires tag firmware support)",
+    )
+    parser.add_argument(
+        "--max-rate",
+        type=float,
+        default=50.0,
+        help="full reporting rate of the tags in Hz (default: 50)",
+    )
+    parser.add_argument(
+        "--control-interval",
+        type=float,
+        default=10.0,
+        help="seconds between streaming adjustments (default: 10)",
+    )
+
+    args = parser.parse_args()
+
+    asyncio.run(main(args))
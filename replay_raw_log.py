@@ -0,0 +1,100 @@
+import argparse
+import asyncio
+import contextlib
+import importlib
+import os
+import time
+
+from raw_log import read_raw_log
+
+RECEIVERS = {"v2": "receiver_multi_v2", "auto": "receiver_multi_auto"}
+
+
+async def replay(receiver, paths, realtime, batch_size):
+    """
+    Pushes the frames of the raw logs through the receiver's queue, reassembly,
+    parsing and CSV storage path. Returns (frames, bytes).
+    """
+    receiver.rx_queue = asyncio.Queue()
+    worker = asyncio.ensure_future(receiver.process_rx_queue())
+    frames = 0
+    total_bytes = 0
+
+    for path in paths:
+        start = time.monotonic()
+        last_offset = 0.0
+        for device_address, device_name, offset, timestamp, data in read_raw_log(path):
+            if offset < last_offset:
+                # The next recording session of the log starts its offsets again
+                start = time.monotonic()
+            last_offset = offset
+            if device_address not in receiver.buffers:
+                # Same per-device state as connect_and_init_device
+                receiver.buffers[device_address] = ""
+                receiver.csv_writers[device_address], receiver.csv_files[device_address] = receiver.create_csv_writer(device_name, device_address)
+
+            if realtime:
+                delay = offset - (time.monotonic() - start)
+                if delay > 0:
+                    await receiver.rx_queue.join()
+                    await asyncio.sleep(delay)
+
+            receiver.rx_queue.put_nowait((device_address, device_name, timestamp, data))
+            frames += 1
+            total_bytes += len(data)
+            if frames % batch_size == 0:
+                await receiver.rx_queue.join()
+
+    await receiver.rx_queue.join()
+    worker.cancel()
+    for csv_file in receiver.csv_files.values():
+        csv_file.close()
+    return frames, total_bytes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay raw notification logs recorded with --record-raw")
+
+    parser.add_argument("logs", nargs="+", help="raw notification log files")
+    parser.add_argument(
+        "--receiver",
+        choices=sorted(RECEIVERS),
+        default="v2",
+        help="receiver whose parsing and storage path is used (default: v2)",
+    )
+    parser.add_argument(
+        "--output",
+        default="replay_data",
+        help="directory the CSV files are written to (default: replay_data)",
+    )
+    parser.add_argument(
+        "--realtime",
+        action="store_true",
+        help="replay at the recorded speed instead of as fast as possible",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=1000,
+        help="frames queued before waiting for the writer (default: 1000)",
+    )
+    parser.add_argument(
+        "--verbose",
+        action="store_true",
+        help="keep the receiver's per-message output",
+    )
+
+    args = parser.parse_args()
+
+    receiver = importlib.import_module(RECEIVERS[args.receiver])
+    receiver.SENSOR_DATA_DIR = args.output
+
+    started = time.perf_counter()
+    with open(os.devnull, 'w') as devnull:
+        with contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(devnull):
+            frames, total_bytes = asyncio.run(replay(receiver, args.logs, args.realtime, args.batch_size))
+    elapsed = time.perf_counter() - started
+
+    print(f"Replayed {frames} frames ({total_bytes} bytes) in {elapsed:.3f} s")
+    if elapsed > 0:
+        print(f"{frames / elapsed:.0f} frames/s, {total_bytes / elapsed / 1e6:.2f} MB/s")
@@ -0,0 +1,290 @@
+import asyncio
+import json
+import math
+import time
+from array import array
+
+FIELDS = ["accel.X", "accel.Y", "accel.Z", "gyro.X", "gyro.Y", "gyro.Z", "temp.O", "temp.A", "battery.V"]
+NAN = float("nan")
+INF = float("inf")
+BLOCK = 256  # Samples per min/max block
+SUM_BLOCK = 32  # Samples between snapshots of the running totals
+
+
+class DeviceRing:
+    """
+    Fixed-size ring buffer of the parsed samples of one device.
+
+    Every column is a preallocated array of doubles (timestamps in seconds since
+    the epoch, missing values stored as NaN), so appending a sample only
+    overwrites slots and never allocates. Timestamps are increasing, which lets
+    the window queries find their start with a binary search.
+
+    For the stats queries every field also keeps running totals (count, sum,
+    sum of squares) with a snapshot every SUM_BLOCK slots, so the sums over any
+    window are a subtraction plus at most SUM_BLOCK samples. The sums are of the
+    differences to the field's first value, which keeps them small and the
+    variance accurate. The min/max of every block of BLOCK slots is kept too, so
+    a window's min/max only looks at its blocks and at most two partial blocks.
+    All of this adds about 10% to the memory of the columns, which is 80 bytes
+    per sample.
+    """
+
+    def __init__(self, capacity, name=None):
+        self.capacity = capacity
+        self.name = name
+        self.times = array('d', bytes(8 * capacity))
+        self.columns = {field: array('d', bytes(8 * capacity)) for field in FIELDS}
+        self.totals = {field: [0.0, 0.0, 0.0] for field in FIELDS}  # Count, sum and sum of squares so far
+        self.reference = {}  # First value of every field, the sums are relative to it
+        snapshots = (capacity + SUM_BLOCK - 1) // SUM_BLOCK
+        self.before = {field: [array('d', bytes(8 * snapshots)) for _ in range(3)] for field in FIELDS}  # Totals before every SUM_BLOCK-th slot
+        blocks = (capacity + BLOCK - 1) // BLOCK
+        self.block_min = {field: array('d', [INF]) * blocks for field in FIELDS}
+        self.block_max = {field: array('d', [-INF]) * blocks for field in FIELDS}
+        self.start = 0  # Physical index of the oldest sample
+        self.count = 0
+        self.latest = {"battery.V": (NAN, NAN), "temp.O": (NAN, NAN), "temp.A": (NAN, NAN)}  # (time, value)
+
+    def append(self, t, parsed_data):
+        index = (self.start + self.count) % self.capacity
+        if self.count == self.capacity:
+            self.start = (self.start + 1) % self.capacity
+        else:
+            self.count += 1
+
+        self.times[index] = t
+        block = index // BLOCK
+        new_block = index % BLOCK == 0
+        snapshot = index // SUM_BLOCK if index % SUM_BLOCK == 0 else None
+        for field, column in self.columns.items():
+            totals = self.totals[field]
+            if snapshot is not None:
+                before_count, before_sum, before_sum_sq = self.before[field]
+                before_count[snapshot], before_sum[snapshot], before_sum_sq[snapshot] = totals
+            block_min, block_max = self.block_min[field], self.block_max[field]
+            if new_block:
+                # The block's old samples are only read through its partial scan from now on
+                block_min[block], block_max[block] = INF, -INF
+            value = parsed_data[field]
+            if value == "":
+                column[index] = NAN
+                continue
+            column[index] = value
+            difference = value - self.reference.setdefault(field, value)
+            totals[0] += 1
+            totals[1] += difference
+            totals[2] += difference * difference
+            if value < block_min[block]:
+                block_min[block] = value
+            if value > block_max[block]:
+                block_max[block] = value
+        for field in self.latest:
+            if parsed_data[field] != "":
+                self.latest[field] = (t, parsed_data[field])
+
+    def _physical(self, logical):
+        return (self.start + logical) % self.capacity
+
+    def _first_after(self, t):
+        # Binary search over the logical (oldest to newest) order
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.times[self._physical(middle)] < t:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _segments(self, first):
+        # Physical (begin, end) ranges holding the logical samples from `first` on
+        if first == self.count:
+            return []
+        begin = self._physical(first)
+        end = self._physical(self.count)
+        if begin < end:
+            return [(begin, end)]
+        return [(begin, self.capacity), (0, end)]
+
+    def _slice(self, column, first):
+        parts = [column[begin:end] for begin, end in self._segments(first)]
+        if not parts:
+            return column[0:0]
+        return parts[0] if len(parts) == 1 else parts[0] + parts[1]
+
+    def window(self, seconds, now=None):
+        """Returns the samples of the last `seconds` as a dictionary of arrays."""
+        now = time.time() if now is None else now
+        first = self._first_after(now - seconds)
+        result = {"time": self._slice(self.times, first)}
+        for field, column in self.columns.items():
+            result[field] = self._slice(column, first)
+        return result
+
+    def _min_max(self, field, segments):
+        # min()/max() run in C and never pick a NaN after the first item, which is the +/-INF start value
+        column = self.columns[field]
+        low, high = INF, -INF
+        for begin, end in segments:
+            first_block = -(-begin // BLOCK)
+            last_block = end // BLOCK
+            if first_block < last_block:
+                # Whole blocks from their min/max, the partial blocks at both ends sample by sample
+                low = min(low, min(self.block_min[field][first_block:last_block]))
+                high = max(high, max(self.block_max[field][first_block:last_block]))
+                parts = (column[begin:first_block * BLOCK], column[last_block * BLOCK:end])
+            else:
+                parts = (column[begin:end],)
+            for part in parts:
+                low = min(low, *part) if part else low
+                high = max(high, *part) if part else high
+        return low, high
+
+    def _sums(self, field, first):
+        """
+        Returns the count, sum and sum of squares (relative to the reference) of
+        the field's samples from logical index `first` on.
+        """
+        remaining = self.count - first
+        begin = self._physical(first)
+        boundary = min((begin // SUM_BLOCK + 1) * SUM_BLOCK, self.capacity)
+        count = total = total_sq = 0.0
+        if remaining > boundary - begin:
+            # The snapshot at the next boundary was taken inside the window, the
+            # totals since then are one subtraction
+            snapshot = (boundary % self.capacity) // SUM_BLOCK
+            count, total, total_sq = (value - before[snapshot] for value, before in zip(self.totals[field], self.before[field]))
+            end = boundary
+        else:
+            end = begin + remaining
+        reference = self.reference.get(field, 0.0)
+        for value in self.columns[field][begin:end]:
+            if value == value:  # NaN != NaN
+                difference = value - reference
+                count += 1
+                total += difference
+                total_sq += difference * difference
+        return count, total, total_sq
+
+    def stats(self, seconds, now=None):
+        """Returns count, mean, std, min and max of every field over the last `seconds`."""
+        now = time.time() if now is None else now
+        first = self._first_after(now - seconds)
+        segments = self._segments(first)
+        result = {"samples": self.count - first}
+        for field in FIELDS:
+            count, total, total_sq = self._sums(field, first)
+            if count < 1:
+                result[field] = None
+                continue
+            count = round(count)
+            mean = total / count
+            variance = max(total_sq / count - mean * mean, 0.0)
+            low, high = self._min_max(field, segments)
+            result[field] = {"count": count, "mean": self.reference[field] + mean, "std": math.sqrt(variance), "min": low, "max": high}
+        return result
+
+
+class RingCache:
+    """
+    In-memory cache of the last `minutes` of parsed samples of every device,
+    queried by device address, or by name when no other device shares it.
+    """
+
+    def __init__(self, minutes=10.0, max_rate_hz=100.0):
+        self.capacity = int(minutes * 60 * max_rate_hz)
+        self.rings = {}  # DeviceRing by device address
+        self.names = {}  # Device addresses by device name, tags may share a name
+
+    def add(self, device_address, device_name, t, parsed_data):
+        ring = self.rings.get(device_address)
+        if ring is None:
+            ring = self.rings[device_address] = DeviceRing(self.capacity, device_name)
+            self.names.setdefault(device_name, []).append(device_address)
+        ring.append(t, parsed_data)
+
+    def ring(self, device):
+        if device in self.rings:
+            return self.rings[device]
+        addresses = self.names.get(device, [])
+        if len(addresses) > 1:
+            raise ValueError(f"device name {device} is shared by {', '.join(addresses)}, query by address")
+        return self.rings[addresses[0]] if addresses else None
+
+    def devices(self):
+        return {address: {"name": ring.name, "samples": ring.count} for address, ring in self.rings.items()}
+
+    def latest(self, device):
+        ring = self.ring(device)
+        return None if ring is None else dict(ring.latest)
+
+    def window(self, device, seconds):
+        ring = self.ring(device)
+        return None if ring is None else ring.window(seconds)
+
+    def stats(self, device, seconds):
+        ring = self.ring(device)
+        return None if ring is None else ring.stats(seconds)
+
+
+def _json_value(value):
+    if isinstance(value, float) and value != value:
+        return None
+    if isinstance(value, array):
+        return [_json_value(v) for v in value]
+    if isinstance(value, (tuple, list)):
+        return [_json_value(v) for v in value]
+    if isinstance(value, dict):
+        return {key: _json_value(v) for key, v in value.items()}
+    return value
+
+
+def handle_query(cache, request):
+    """
+    Answers one query, a dictionary such as {"query": "stats", "device":
+    "<address>", "seconds": 60}. Queries are devices, latest, window and stats.
+    """
+    query = request.get("query")
+    if query == "devices":
+        return {"devices": cache.devices()}
+    device = request.get("device")
+    if query == "latest":
+        result = cache.latest(device)
+    elif query == "window":
+        result = cache.window(device, float(request.get("seconds", 10)))
+    elif query == "stats":
+        result = cache.stats(device, float(request.get("seconds", 60)))
+    else:
+        return {"error": f"unknown query: {query}"}
+    if result is None:
+        return {"error": f"unknown device: {device}"}
+    return {query: _json_value(result)}
+
+
+async def serve_queries(cache, port, host="127.0.0.1"):
+    """
+    Serves the cache on a local TCP port, one JSON query per line and one JSON
+    answer per line, e.g. echo '{"query": "devices"}' | nc localhost 8765
+    """
+    async def handle_client(reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    response = handle_query(cache, json.loads(line))
+                except (ValueError, TypeError, AttributeError) as e:
+                    response = {"error": str(e)}
+                writer.write(json.dumps(response).encode('utf-8') + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle_client, host, port)
+    print(f"Serving the sample cache on {host}:{port}")
+    async with server:
+        await server.serve_forever()
@@ -0,0 +1,164 @@
+import asyncio
+import sys
+import time
+
+from bleak import BleakScanner
+
+# receiver_multi_auto used to scan 5 s every 10 minutes, scanning with active links never exceeds that
+BASELINE_DUTY = 5.0 / 600
+
+
+def passive_scan_args(name_prefix):
+    """
+    Extra BleakScanner arguments for passive scanning. BlueZ only scans passively
+    through an advertisement monitor, which requires patterns: these match the
+    tags by the start of their local name.
+    """
+    if not sys.platform.startswith("linux"):
+        return {}
+    from bleak.assigned_numbers import AdvertisementDataType
+    try:
+        from bleak.args.bluez import BlueZScannerArgs, OrPattern
+    except ImportError:  # bleak < 1.0
+        from bleak.backends.bluezdbus.advertisement_monitor import OrPattern
+        from bleak.backends.bluezdbus.scanner import BlueZScannerArgs
+
+    content = name_prefix.encode('utf-8')
+    return {"bluez": BlueZScannerArgs(or_patterns=[
+        OrPattern(0, AdvertisementDataType.COMPLETE_LOCAL_NAME, content),
+        OrPattern(0, AdvertisementDataType.SHORTENED_LOCAL_NAME, content),
+    ])}
+
+
+class ScanScheduler:
+    """
+    Decides when and how long the receiver scans so that scanning does not take
+    radio time away from the connected tags.
+
+    With no active link it scans back to back. With active links the scan duty
+    cycle starts at the receiver's old cadence (5 s every 10 minutes), shrinks
+    with the number of links and is halved again when the links are busy.
+    Scanning stops entirely once every registered tag (or the maximum number of
+    links) is connected. When all the tags still missing have been seen before
+    or registered, the scan is passive and matches them by address.
+
+    The link throughput is accounted separately while scanning and while idle,
+    which shows how much scanning costs the connected tags.
+    """
+
+    def __init__(self, name_substring, registered=None, max_links=7, window=5.0, short_window=2.0,
+                 max_duty=BASELINE_DUTY, min_duty=BASELINE_DUTY / 4, busy_throughput=2000.0, check_interval=10.0):
+        self.name_substring = name_substring
+        self.registered = set(registered or [])  # Addresses that must all be connected, empty to learn them
+        self.max_links = max_links
+        self.window = window  # Scan window in seconds with no active link
+        self.short_window = short_window  # Scan window in seconds with active links
+        self.max_duty = max_duty  # Duty cycle with a single active link
+        self.min_duty = min_duty  # Lowest duty cycle, used when only looking for new tags
+        self.busy_throughput = busy_throughput  # Bytes per second per link above which the duty is halved
+        self.check_interval = check_interval  # Seconds to wait before planning again when not scanning
+        self.known = {}  # Device name of every tag seen, by address
+        self.passive_supported = True
+
+        self.scanning = False
+        self.period_start = time.monotonic()
+        self.period_bytes = 0
+        self.link_rate = 0.0  # Smoothed link throughput in bytes per second
+        self.totals = {True: [0, 0.0], False: [0, 0.0]}  # Bytes and seconds, while scanning and while idle
+
+    def record_rx(self, nbytes):
+        self.period_bytes += nbytes
+
+    def _switch(self, scanning):
+        now = time.monotonic()
+        elapsed = now - self.period_start
+        totals = self.totals[self.scanning]
+        totals[0] += self.period_bytes
+        totals[1] += elapsed
+        if elapsed > 0:
+            self.link_rate = 0.5 * self.link_rate + 0.5 * self.period_bytes / elapsed
+        self.scanning = scanning
+        self.period_start = now
+        self.period_bytes = 0
+
+    def missing(self, connected):
+        targets = self.registered or set(self.known)
+        return targets - set(connected)
+
+    def plan(self, connected):
+        """
+        Returns (window, pause) in seconds for the next scan, or None when no
+        scan is needed. `connected` holds the addresses of the active links.
+        """
+        active = len(connected)
+        if active >= self.max_links or (self.registered and not self.missing(connected)):
+            return None
+        if active == 0:
+            return self.window, 1.0
+
+        duty = self.max_duty / active
+        if self.link_rate / active > self.busy_throughput:
+            duty /= 2
+        if not self.registered and not self.missing(connected):
+            # Every tag seen so far is connected, only look for new ones
+            duty = self.min_duty
+        duty = min(max(duty, self.min_duty), self.max_duty)
+        return self.short_window, self.short_window / duty - self.short_window
+
+    async def scan(self, window, connected):
+        """
+        Scans for `window` seconds and returns the matching devices that are not
+        connected yet, as a list of (device, name) tuples.
+        """
+        missing = self.missing(connected)
+        passive = self.passive_supported and bool(missing)
+        found = {}
+
+        def detection_callback(device, advertisement_data):
+            name = device.name or advertisement_data.local_name
+            if name and self.name_substring in name:
+                self.known[device.address] = name
+            elif device.address in self.registered and device.address not in self.known:
+                self.known[device.address] = name or device.address
+            if device.address in self.known and device.address not in connected:
+                found[device.address] = (device, self.known[device.address])
+
+        self._switch(True)
+        try:
+            scanner = None
+            if passive:
+                try:
+                    scanner = BleakScanner(detection_callback=detection_callback, scanning_mode="passive",
+                                           **passive_scan_args(self.name_substring))
+                    await scanner.start()
+                except Exception as e:
+                    # Passive scanning is not available on macOS, on BlueZ it needs the
+                    # advertisement monitor (BlueZ >= 5.56)
+                    print(f"Passive scanning not supported, falling back to active scanning: {e}")
+                    self.passive_supported = False
+                    scanner = None
+            if scanner is None:
+                scanner = BleakScanner(detection_callback=detection_callback)
+                await scanner.start()
+            try:
+                await asyncio.sleep(window)
+            finally:
+                await scanner.stop()
+        finally:
+            self._switch(False)
+
+        return list(found.values())
+
+    def metrics(self):
+        scan_bytes, scan_time = self.totals[True]
+        idle_bytes, idle_time = self.totals[False]
+        return {
+            "scan_duty": scan_time / (scan_time + idle_time) if scan_time + idle_time > 0 else 0.0,
+            "throughput_scanning": scan_bytes / scan_time if scan_time > 0 else 0.0,
+            "throughput_idle": idle_bytes / idle_time if idle_time > 0 else 0.0,
+        }
+
+    def report(self):
+        metrics = self.metrics()
+        return (f"Scan duty {metrics['scan_duty']:.1%}, link throughput {metrics['throughput_scanning'] / 1000:.2f} kB/s "
+                f"while scanning vs {metrics['throughput_idle'] / 1000:.2f} kB/s idle")
@@ -0,0 +1,139 @@
+import asyncio
+import os
+import signal
+
+
+class ShutdownCoordinator:
+    """
+    Coordinates a graceful shutdown of a receiver.
+
+    On SIGINT/SIGTERM the intake is stopped (scan and connection tasks are
+    cancelled and notifications are stopped), the registered queues are drained
+    within a deadline, the termination command is sent to every connected tag
+    concurrently and the open CSV files are flushed and closed.
+    """
+
+    def __init__(self, rx_uuid, tx_uuid, term_command, drain_timeout=10.0, command_timeout=5.0):
+        self.rx_uuid = rx_uuid
+        self.tx_uuid = tx_uuid
+        self.term_command = term_command
+        self.drain_timeout = drain_timeout  # Seconds allowed for draining all queues
+        self.command_timeout = command_timeout  # Seconds allowed per tag for stop/terminate/disconnect
+        self.stopping = asyncio.Event()
+        self.queues = {}  # (queue, in_flight) to drain, by name
+        self.tasks = []  # Intake tasks (scanning, connecting) cancelled when shutting down
+
+    def install(self):
+        loop = asyncio.get_event_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.request_shutdown, sig.name)
+            except NotImplementedError:
+                # Windows event loops do not support add_signal_handler
+                signal.signal(sig, lambda s, f: loop.call_soon_threadsafe(self.request_shutdown, signal.Signals(s).name))
+
+    def request_shutdown(self, reason="request"):
+        if self.stopping.is_set():
+            print(f"{reason} received, shutdown already in progress.")
+            return
+        print(f"{reason} received, shutting down.")
+        self.stopping.set()
+
+    def add_queue(self, name, queue, in_flight=None):
+        """
+        Registers a queue to drain. `in_flight` returns the number of items the
+        worker has taken off the queue and not finished yet, so the report counts
+        them too.
+        """
+        self.queues[name] = (queue, in_flight or (lambda: 0))
+
+    def add_task(self, task):
+        self.tasks.append(task)
+        return task
+
+    async def wait(self):
+        await self.stopping.wait()
+
+    async def _with_timeout(self, coro, what, address):
+        try:
+            await asyncio.wait_for(coro, self.command_timeout)
+            return True
+        except Exception as e:
+            print(f"Failed to {what} {address}: {e}")
+            return False
+
+    async def _stop_notify(self, client):
+        if client.is_connected:
+            await self._with_timeout(client.stop_notify(self.tx_uuid), "stop notifications from", client.address)
+
+    async def _terminate(self, client):
+        if not client.is_connected:
+            return False
+        sent = await self._with_timeout(client.write_gatt_char(self.rx_uuid, self.term_command), "send termination command to", client.address)
+        await self._with_timeout(client.disconnect(), "disconnect from", client.address)
+        return sent
+
+    async def _drain(self):
+        drained = {}
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + self.drain_timeout
+        for name, (queue, in_flight) in self.queues.items():
+            pending = queue.qsize() + in_flight()
+            try:
+                await asyncio.wait_for(queue.join(), max(deadline - loop.time(), 0))
+            except asyncio.TimeoutError:
+                print(f"Drain deadline exceeded for {name} queue")
+            left = queue.qsize() + in_flight()
+            drained[name] = (pending - left, left)
+        return drained
+
+    async def shutdown(self, clients, csv_files, buffers):
+        """
+        Runs the shutdown sequence and returns a report of what was flushed.
+        `clients` is an iterable of BleakClient, `csv_files` and `buffers` are
+        the receiver's per-device dictionaries.
+        """
+        self.stopping.set()
+
+        # Stop intake: no new scans or connections, no new notifications
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        # Taken after the cancellation so tags connected while it was in progress are included
+        clients = list(clients)
+        await asyncio.gather(*(self._stop_notify(client) for client in clients))
+
+        # Drain the queues so every received frame reaches the CSV files
+        drained = await self._drain()
+
+        # Tell all tags to stop streaming at once
+        terminated = await asyncio.gather(*(self._terminate(client) for client in clients))
+
+        flushed = 0
+        for address, csv_file in list(csv_files.items()):
+            try:
+                if not csv_file.closed:
+                    csv_file.flush()
+                    os.fsync(csv_file.fileno())
+                    csv_file.close()
+                    flushed += 1
+            except OSError as e:
+                print(f"Failed to close CSV file for {address}: {e}")
+
+        discarded = {address: len(buffer) for address, buffer in buffers.items() if buffer}
+
+        report = {
+            "drained": drained,
+            "terminated": sum(terminated),
+            "clients": len(clients),
+            "files_flushed": flushed,
+            "partial_messages": discarded,
+        }
+        print("Shutdown report:")
+        for name, (count, left) in drained.items():
+            print(f"  {name} queue: {count} items drained, {left} left")
+        print(f"  Termination command sent to {report['terminated']}/{report['clients']} tags")
+        print(f"  {flushed} CSV files synced and closed")
+        for address, length in discarded.items():
+            print(f"  {length} characters of incomplete message discarded for {address}")
+        return report
@@ -0,0 +1,92 @@
+import argparse
+import os
+import queue
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+from ahm_core import STARTUP_MARK_PREFIX
+
+
+def read_marks(stream, marks):
+    for line in stream:
+        if line.startswith(STARTUP_MARK_PREFIX):
+            marks.put((time.perf_counter(), line.split()[1]))
+    marks.put((time.perf_counter(), None))
+
+
+def run_once(command, stdin_text, timeout):
+    """
+    Starts the command and returns the seconds from process start to each startup
+    mark, until the first captured advertisement or notification (or the timeout).
+    """
+    env = dict(os.environ, AHM_STARTUP_BENCHMARK="1")
+    started = time.perf_counter()
+    process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, env=env, text=True)
+    if stdin_text:
+        process.stdin.write(stdin_text + "\n")
+        process.stdin.flush()
+
+    marks = queue.Queue()
+    threading.Thread(target=read_marks, args=(process.stdout, marks), daemon=True).start()
+
+    results = {}
+    deadline = started + timeout
+    while True:
+        try:
+            when, event = marks.get(timeout=max(deadline - time.perf_counter(), 0))
+        except queue.Empty:
+            break
+        if event is None:
+            break
+        results[event] = when - started
+        if event.startswith("first_"):
+            break
+
+    process.terminate()
+    try:
+        process.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        process.kill()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the time from process start to the first captured advertisement or notification")
+
+    parser.add_argument("script", help="script to benchmark, e.g. RSSI_Scanner.py or receiver_multi_auto.py")
+    parser.add_argument("script_args", nargs=argparse.REMAINDER, help="arguments passed to the script")
+    parser.add_argument(
+        "--runs",
+        type=int,
+        default=5,
+        help="number of process starts (default: 5)",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=60.0,
+        help="seconds to wait for the first capture in each run (default: 60)",
+    )
+    parser.add_argument(
+        "--stdin",
+        help="text sent to the script's standard input, e.g. the device indices for receiver_multi_v2",
+    )
+
+    args = parser.parse_args()
+
+    command = [sys.executable, "-u", args.script] + args.script_args
+    runs = []
+    for run in range(args.runs):
+        results = run_once(command, args.stdin, args.timeout)
+        runs.append(results)
+        print(f"Run {run + 1}: " + ", ".join(f"{event} {seconds:.3f} s" for event, seconds in results.items()))
+
+    events = []
+    for results in runs:
+        events.extend(event for event in results if event not in events)
+    for event in events:
+        values = [results[event] for results in runs if event in results]
+        print(f"{event}: min {min(values):.3f} s, median {statistics.median(values):.3f} s, max {max(values):.3f} s ({len(values)}/{len(runs)} runs)")
@@ -0,0 +1,171 @@
+import math
+import time
+
+from ahm_core import NUS_RX_UUID
+
+# Commands written to the NUS RX characteristic next to the existing start/stop
+# commands ('I'/'T'). The tag firmware has to implement them, tags that do not
+# know a command are expected to ignore it. Raw and heartbeat send the existing
+# "A:x,y,z;G:x,y,z_" and "V:v;T:o,a_" messages, so parse_complete_message stores
+# them as usual: raw sends both at the reporting rate, heartbeat sends one of
+# each per period. Summary samples at the reporting rate and sends one "S:..._"
+# message per window (see parse_summary_message) and one "V:v;T:o,a_" message.
+# A batch is several complete messages in one notification, which process_frame
+# already splits (the rows share the notification's time).
+RATE_COMMAND = "R{}"  # Reporting rate in Hz, e.g. b"R25"
+MODE_COMMANDS = {"raw": "MR", "summary": "MS", "heartbeat": "MH"}
+BATCH_COMMAND = "B{}"  # Complete messages per notification, e.g. b"B4"
+
+
+def default_levels(max_rate_hz, summary=False):
+    """
+    Streaming levels from the most to the least data, as (mode, rate, batch).
+    Lower rates are batched so each notification still carries enough data to
+    be worth the radio time. The summary level, which keeps the full sampling
+    rate but only sends window statistics, is only used when something stores
+    the summaries.
+    """
+    levels = [
+        ("raw", max_rate_hz, 1),
+        ("raw", max_rate_hz / 2, 2),
+        ("raw", max_rate_hz / 4, 4),
+    ]
+    if summary:
+        levels.append(("summary", max_rate_hz, 1))
+    levels.append(("heartbeat", 1, 1))
+    return levels
+
+
+class TagController:
+    """
+    Adapts the streaming level of one tag to the host and link conditions.
+
+    Every `adjust` call moves the tag at most one level: down (less data) when
+    the host queue is backing up, when fewer messages arrive than the level
+    should produce (poor link) or when the tag is idle, and back up once the
+    pressure has been gone for `hold_intervals` intervals. A tag that was moved
+    down because it was idle only moves back up when its accel samples or
+    summaries show motion again (every level still carries some), so an idle
+    tag stays at the heartbeat level instead of being bounced between levels.
+    A low battery.V puts a floor on the level regardless.
+
+    The controller is kept per address, a tag that reconnects gets its level
+    back through `reconnect` instead of starting over at full rate.
+    """
+
+    def __init__(self, client, device_name, max_rate_hz=50.0, levels=None, summary=False, queue_high=500, queue_low=50,
+                 min_link_quality=0.5, idle_std=0.02, low_battery=3.5, critical_battery=3.3, hold_intervals=3):
+        self.client = client
+        self.device_name = device_name
+        self.levels = levels or default_levels(max_rate_hz, summary)
+        self.queue_high = queue_high  # Queued frames above which tags are slowed down
+        self.queue_low = queue_low  # Queued frames below which tags may speed up again
+        self.min_link_quality = min_link_quality  # Received / expected messages below which the link is poor
+        self.idle_std = idle_std  # Accel magnitude std (g) below which the tag is considered idle
+        self.low_battery = low_battery
+        self.critical_battery = critical_battery
+        self.hold_intervals = hold_intervals  # Calm intervals needed before moving up a level
+        self.level = 0
+        self.calm = 0
+        self.idle = False  # Moved down because the tag was idle, waiting for motion
+        self.sent = None  # (mode, rate, batch) last sent to the tag, None until the first adjust
+        self.battery = None
+        self._reset_window()
+
+    def _reset_window(self):
+        self.window_start = time.monotonic()
+        self.messages = 0
+        self.motion_count = 0
+        self.motion_sum = 0.0
+        self.motion_sum_sq = 0.0
+
+    def observe(self, parsed_data):
+        """Accounts one parsed message, called from the parsing path."""
+        self.messages += 1
+        if parsed_data["battery.V"] != "":
+            self.battery = parsed_data["battery.V"]
+        if parsed_data["accel.X"] != "":
+            magnitude = math.sqrt(parsed_data["accel.X"] ** 2 + parsed_data["accel.Y"] ** 2 + parsed_data["accel.Z"] ** 2)
+            self.motion_count += 1
+            self.motion_sum += magnitude
+            self.motion_sum_sq += magnitude * magnitude
+
+    def observe_summary(self, summary):
+        """Accounts one summary message, its window statistics stand in for the accel samples."""
+        self.messages += 1
+        count = summary["samples"]
+        if count > 0:
+            mean = summary["accel.mag.mean"]
+            self.motion_count += count
+            self.motion_sum += count * mean
+            self.motion_sum_sq += count * (summary["accel.mag.var"] + mean * mean)
+
+    def _floor(self):
+        # Lowest level (most data) allowed by the battery
+        if self.battery is None:
+            return 0
+        if self.battery < self.critical_battery:
+            return len(self.levels) - 1
+        if self.battery < self.low_battery:
+            # One level above heartbeat
+            return max(len(self.levels) - 2, 0)
+        return 0
+
+    def decide(self, queue_depth):
+        """Returns the level for the next interval from the last interval's observations."""
+        elapsed = time.monotonic() - self.window_start
+        mode, rate, batch = self.levels[self.level]
+        link_quality = None
+        if mode == "raw" and elapsed > 0 and rate > 0:
+            link_quality = self.messages / (elapsed * rate)
+        idle = moving = False
+        if self.motion_count > 1:
+            mean = self.motion_sum / self.motion_count
+            std = math.sqrt(max(self.motion_sum_sq / self.motion_count - mean * mean, 0.0))
+            idle = std < self.idle_std
+            moving = not idle
+
+        level = self.level
+        if queue_depth > self.queue_high or (link_quality is not None and link_quality < self.min_link_quality) or idle:
+            self.calm = 0
+            self.idle = idle
+            level = min(level + 1, len(self.levels) - 1)
+        elif self.idle:
+            # Only evidence of motion brings an idle tag back up, one level per interval
+            if moving and queue_depth < self.queue_low:
+                level = max(level - 1, 0)
+                self.idle = level > 0
+        elif queue_depth < self.queue_low and self.messages > 0:
+            self.calm += 1
+            if self.calm >= self.hold_intervals:
+                self.calm = 0
+                level = max(level - 1, 0)
+        return max(level, self._floor())
+
+    async def reconnect(self, client):
+        """Switches to the new connection of the tag and sends it the current level again."""
+        self.client = client
+        self.sent = None
+        self._reset_window()
+        await self.apply(*self.levels[self.level])
+
+    async def adjust(self, queue_depth):
+        self.level = self.decide(queue_depth)
+        self._reset_window()
+        await self.apply(*self.levels[self.level])
+
+    async def apply(self, mode, rate, batch):
+        """Sends only the commands whose setting changed."""
+        commands = []
+        sent_mode, sent_rate, sent_batch = self.sent or (None, None, None)
+        if mode != sent_mode:
+            commands.append(MODE_COMMANDS[mode])
+        if rate != sent_rate:
+            commands.append(RATE_COMMAND.format(max(int(round(rate)), 1)))
+        if batch != sent_batch:
+            commands.append(BATCH_COMMAND.format(batch))
+        for command in commands:
+            await self.client.write_gatt_char(NUS_RX_UUID, command.encode('utf-8'))
+        if commands:
+            print(f"Sent {', '.join(commands)} to {self.device_name} ({mode}, {rate:g} Hz, {batch} per notification)")
+        self.sent = (mode, rate, batch)